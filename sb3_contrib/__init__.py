@@ -1,12 +1,15 @@
 import os
+from typing import TYPE_CHECKING, Any, List
 
 from sb3_contrib.ars import ARS
 from sb3_contrib.ppo_mask import MaskablePPO
-from sb3_contrib.ppo_recurrent import RecurrentPPO
 from sb3_contrib.qrdqn import QRDQN
 from sb3_contrib.tqc import TQC
 from sb3_contrib.trpo import TRPO
 
+if TYPE_CHECKING:
+    from sb3_contrib.ppo_recurrent import RecurrentPPO
+
 # Read version from file
 version_file = os.path.join(os.path.dirname(__file__), "version.txt")
 with open(version_file) as file_handler:
@@ -20,3 +23,18 @@ __all__ = [
     "TQC",
     "TRPO",
 ]
+
+
+def __getattr__(name: str) -> Any:
+    # RecurrentPPO is imported lazily (PEP 562), see sb3_contrib/ppo_recurrent/__init__.py
+    if name == "RecurrentPPO":
+        from sb3_contrib.ppo_recurrent import RecurrentPPO
+
+        globals()[name] = RecurrentPPO
+        return RecurrentPPO
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> List[str]:
+    # Include the lazily imported RecurrentPPO for completion
+    return sorted(set(globals()) | {"RecurrentPPO"})
@@ -1,4 +1,23 @@
+from typing import TYPE_CHECKING, Any, List
+
 from sb3_contrib.ppo_recurrent.policies import CnnLstmPolicy, MlpLstmPolicy, MultiInputLstmPolicy
-from sb3_contrib.ppo_recurrent.ppo_recurrent import RecurrentPPO
+
+if TYPE_CHECKING:
+    from sb3_contrib.ppo_recurrent.ppo_recurrent import RecurrentPPO
 
 __all__ = ["CnnLstmPolicy", "MlpLstmPolicy", "MultiInputLstmPolicy", "RecurrentPPO"]
+
+
+def __getattr__(name: str) -> Any:
+    # Import the algorithm lazily (PEP 562), only the policies are needed in most cases
+    if name == "RecurrentPPO":
+        from sb3_contrib.ppo_recurrent.ppo_recurrent import RecurrentPPO
+
+        globals()[name] = RecurrentPPO
+        return RecurrentPPO
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> List[str]:
+    # Include the lazily imported RecurrentPPO for completion
+    return sorted(set(globals()) | {"RecurrentPPO"})
@@ -1,7 +1,8 @@
-import os
+import io
 import pathlib
 from collections import OrderedDict
 from copy import deepcopy
+from typing import Dict, Iterable, Type
 
 import gymnasium as gym
 import numpy as np
@@ -10,14 +11,97 @@ import torch as th
 from stable_baselines3.common.base_class import BaseAlgorithm
 from stable_baselines3.common.envs import FakeImageEnv, IdentityEnv, IdentityEnvBox
 from stable_baselines3.common.utils import get_device
-from stable_baselines3.common.vec_env import DummyVecEnv
+from stable_baselines3.common.vec_env import DummyVecEnv, VecEnv
 
 from sb3_contrib import ARS, QRDQN, TQC, TRPO
 
 MODEL_LIST = [ARS, QRDQN, TQC, TRPO]
+DEVICE_LIST = [
+    "auto",
+    "cpu",
+    pytest.param("cuda", marks=pytest.mark.skipif(not th.cuda.is_available(), reason="CUDA not available")),
+]
 
 
-def select_env(model_class: BaseAlgorithm) -> gym.Env:
+def _clone_params(params: Dict[str, Dict[str, th.Tensor]]) -> Dict[str, Dict[str, th.Tensor]]:
+    """
+    Clone the tensors returned by ``get_parameters()``, avoiding the overhead of ``deepcopy``.
+    Optimizer state-dicts are kept as references (custom layout, never modified by the tests).
+
+    :param params: Mapping from object name to its state-dict
+    :return: A copy of ``params`` with detached and cloned tensors
+    """
+    return OrderedDict(
+        (name, state_dict if "optim" in name else _clone_state_dict(state_dict)) for name, state_dict in params.items()
+    )
+
+
+def _clone_state_dict(state_dict: Dict[str, th.Tensor]) -> Dict[str, th.Tensor]:
+    """
+    Clone the tensors of a state-dict, avoiding the overhead of ``deepcopy``.
+
+    :param state_dict: A PyTorch state-dict
+    :return: A copy of ``state_dict`` with detached and cloned tensors
+    """
+    return OrderedDict((key, value.detach().clone()) for key, value in state_dict.items())
+
+
+def _rand_like(tensor: th.Tensor, generators: Dict[th.device, th.Generator]) -> th.Tensor:
+    """
+    Equivalent of ``th.rand_like`` that draws from a seeded generator (one per device).
+
+    :param tensor: Tensor defining the shape, dtype and device of the output
+    :param generators: Cache of generators, indexed by device
+    :return: A tensor filled with random numbers uniformly sampled in [0, 1)
+    """
+    if tensor.device not in generators:
+        generators[tensor.device] = th.Generator(device=tensor.device).manual_seed(0)
+    return th.empty_like(tensor).uniform_(0, 1, generator=generators[tensor.device])
+
+
+def _flatcat(state_dict: Dict[str, th.Tensor], keys: Iterable[str]) -> th.Tensor:
+    """
+    Flatten and concatenate the tensors of a state-dict into a single CPU tensor.
+
+    :param state_dict: A PyTorch state-dict
+    :param keys: Keys of the tensors to concatenate (defines the order)
+    :return: A 1D tensor on CPU
+    """
+    return th.cat([state_dict[key].detach().reshape(-1) for key in keys]).cpu()
+
+
+def _assert_state_dicts_close(expected: Dict[str, th.Tensor], actual: Dict[str, th.Tensor], msg: str) -> None:
+    """
+    Check that two state-dicts hold the same values using a single comparison.
+    On mismatch, fall back to comparing key by key to report which tensor differs.
+
+    :param expected: Reference state-dict
+    :param actual: State-dict to check
+    :param msg: Error message
+    """
+    if th.allclose(_flatcat(expected, expected.keys()), _flatcat(actual, expected.keys())):
+        return
+    for key in expected:
+        assert th.allclose(expected[key].to("cpu"), actual[key].to("cpu")), f"{msg} (key: {key})"
+    raise AssertionError(msg)
+
+
+def _collect_observations(env, n_steps=10):
+    """
+    Step a single-env VecEnv with random actions and store the observations
+    in a preallocated array.
+
+    :param env: The vectorized environment (with only one env)
+    :param n_steps: Number of steps
+    :return: The observations, of shape (n_steps, *obs_shape)
+    """
+    observations = np.empty((n_steps, *env.observation_space.shape), dtype=env.observation_space.dtype)
+    for i in range(n_steps):
+        observations[i] = env.step([env.action_space.sample()])[0][0]
+    return observations
+
+
+def select_env(model_class: Type[BaseAlgorithm]) -> gym.Env:
     """
     Selects an environment with the correct action space as QRDQN only supports discrete action space
     """
@@ -27,18 +111,24 @@ def select_env(model_class: BaseAlgorithm) -> gym.Env:
         return IdentityEnvBox(-10, 10)
 
 
-@pytest.mark.parametrize("model_class", MODEL_LIST)
-def test_save_load(tmp_path, model_class):
+def _make_vec_env(model_class: Type[BaseAlgorithm]) -> VecEnv:
     """
-    Test if 'save' and 'load' saves and loads model correctly
-    and if 'get_parameters' and 'set_parameters' and work correctly.
-
-    ''warning does not test function of optimizer parameter load
+    Create a fresh vectorized environment suited to the model class.
 
     :param model_class: (BaseAlgorithm) A RL model
+    :return: A DummyVecEnv wrapping the selected environment
+    """
+    return DummyVecEnv([lambda: select_env(model_class)])
+
+
+def _create_trained_model(model_class):
     """
+    Create a model with a small network and train it for a few steps.
 
-    env = DummyVecEnv([lambda: select_env(model_class)])
+    :param model_class: (BaseAlgorithm) A RL model
+    :return: The trained model and its environment
+    """
+    env = _make_vec_env(model_class)
 
     policy_kwargs = dict(net_arch=[16])
 
@@ -48,17 +138,46 @@ def test_save_load(tmp_path, model_class):
     # create model
     model = model_class("MlpPolicy", env, verbose=1, policy_kwargs=policy_kwargs)
     model.learn(total_timesteps=300)
+    return model, env
+
+
+@pytest.fixture(scope="module", params=MODEL_LIST, ids=lambda model_class: model_class.__name__)
+def trained_model(request):
+    """
+    Train each model only once per module and share the serialized model between tests.
+    Each test creates its own environment with ``_make_vec_env()``.
+
+    :return: The model class and the serialized trained model
+    """
+    model, env = _create_trained_model(request.param)
+    buffer = io.BytesIO()
+    model.save(buffer)
+    env.close()
+    yield request.param, buffer.getvalue()
+
 
+def _check_save_load(model_class, model, env, devices):
+    """
+    Test if 'save' and 'load' saves and loads model correctly
+    and if 'get_parameters' and 'set_parameters' and work correctly.
+
+    ''warning does not test function of optimizer parameter load
+
+    :param model_class: (BaseAlgorithm) A RL model
+    :param model: A trained instance of ``model_class``
+    :param env: The environment of the model
+    :param devices: Devices on which the saved model is loaded
+    """
     env.reset()
-    observations = np.concatenate([env.step([env.action_space.sample()])[0] for _ in range(10)], axis=0)
+    observations = _collect_observations(env)
 
     # Get parameters of different objects
-    # deepcopy to avoid referencing to tensors we are about to modify
-    original_params = deepcopy(model.get_parameters())
+    # clone to avoid referencing to tensors we are about to modify
+    original_params = _clone_params(model.get_parameters())
 
     # Test different error cases of set_parameters.
     # Test that invalid object names throw errors
-    invalid_object_params = deepcopy(original_params)
+    invalid_object_params = _clone_params(original_params)
     invalid_object_params["I_should_not_be_a_valid_object"] = "and_I_am_an_invalid_tensor"
     with pytest.raises(ValueError):
         model.set_parameters(invalid_object_params, exact_match=True)
@@ -85,6 +204,7 @@ def test_save_load(tmp_path, model_class):
         model.set_parameters(missing_state_dict_tensor_params, exact_match=True)
 
     # Test that parameters do indeed change.
+    generators: Dict[th.device, th.Generator] = {}
     random_params = {}
     for object_name, params in original_params.items():
         # Do not randomize optimizer parameters (custom layout)
@@ -93,7 +213,7 @@ def test_save_load(tmp_path, model_class):
         else:
             # Again, skip the last item in state-dict
             random_params[object_name] = OrderedDict(
-                (param_name, th.rand_like(param)) for param_name, param in list(params.items())[:-1]
+                (param_name, _rand_like(param, generators)) for param_name, param in list(params.items())[:-1]
             )
 
     # Update model parameters with the new random values
@@ -110,8 +230,8 @@ def test_save_load(tmp_path, model_class):
         last_key = list(original_params[object_name].keys())[-1]
         for k in original_params[object_name]:
             if k == last_key:
-                # Should be same as before
-                assert th.allclose(
+                # Should be exactly the same as before (untouched)
+                assert th.equal(
                     original_params[object_name][k], new_params[object_name][k]
                 ), "Parameter changed despite not included in the loaded parameters."
             else:
@@ -126,12 +246,14 @@ def test_save_load(tmp_path, model_class):
     selected_actions, _ = model.predict(observations, deterministic=True)
 
     # Check
-    model.save(tmp_path / "test_save.zip")
+    buffer = io.BytesIO()
+    model.save(buffer)
     del model
 
-    # Check if the model loads as expected for every possible choice of device:
-    for device in ["auto", "cpu", "cuda"]:
-        model = model_class.load(str(tmp_path / "test_save.zip"), env=env, device=device)
+    # Check if the model loads as expected for every given device:
+    for device in devices:
+        buffer.seek(0)
+        model = model_class.load(buffer, env=env, device=device)
 
         # check if the model was loaded to the correct device
         assert model.device.type == get_device(device).type
@@ -147,9 +269,9 @@ def test_save_load(tmp_path, model_class):
                 continue
             for key in params[object_name]:
                 assert new_params[object_name][key].device.type == get_device(device).type
-                assert th.allclose(
-                    params[object_name][key].to("cpu"), new_params[object_name][key].to("cpu")
-                ), "Model parameters not the same after save and load."
+            _assert_state_dicts_close(
+                params[object_name], new_params[object_name], "Model parameters not the same after save and load."
+            )
 
         # check if model still selects the same actions
         new_selected_actions, _ = model.predict(observations, deterministic=True)
@@ -160,31 +282,45 @@ def test_save_load(tmp_path, model_class):
 
         del model
 
-    # clear file from os
-    os.remove(tmp_path / "test_save.zip")
+
+@pytest.mark.parametrize("device", DEVICE_LIST)
+def test_save_load(trained_model, device):
+    """
+    Test save and load starting from the model trained once per module.
+    """
+    model_class, model_bytes = trained_model
+    env = _make_vec_env(model_class)
+    model = model_class.load(io.BytesIO(model_bytes), env=env)
+    _check_save_load(model_class, model, env, [device])
+    env.close()
 
 
+@pytest.mark.slow
 @pytest.mark.parametrize("model_class", MODEL_LIST)
-def test_set_env(model_class):
+def test_save_load_from_scratch(model_class):
+    """
+    Same as ``test_save_load`` but with a freshly trained model instead of the cached one,
+    trained once and loaded on every available device.
+    """
+    devices = ["auto", "cpu"] + (["cuda"] if th.cuda.is_available() else [])
+    model, env = _create_trained_model(model_class)
+    _check_save_load(model_class, model, env, devices)
+    env.close()
+
+
+def test_set_env(trained_model):
     """
     Test if set_env function does work correct
-    :param model_class: (BaseAlgorithm) A RL model
     """
+    model_class, model_bytes = trained_model
 
     # use discrete for QRDQN
-    env = DummyVecEnv([lambda: select_env(model_class)])
-    env2 = DummyVecEnv([lambda: select_env(model_class)])
+    env = _make_vec_env(model_class)
+    env2 = _make_vec_env(model_class)
     env3 = select_env(model_class)
 
-    kwargs = dict(policy_kwargs=dict(net_arch=[16]))
-    if model_class in {TQC, QRDQN}:
-        kwargs.update(dict(learning_starts=100))
-        kwargs["policy_kwargs"].update(dict(n_quantiles=20))
-
-    # create model
-    model = model_class("MlpPolicy", env, **kwargs)
-    # learn
-    model.learn(total_timesteps=150)
+    # load already trained model
+    model = model_class.load(io.BytesIO(model_bytes), env=env)
 
     # change env
     model.set_env(env2)
@@ -196,36 +332,43 @@ def test_set_env(model_class):
     # learn again
     model.learn(total_timesteps=150)
 
+    env.close()
+    env2.close()
+    model.get_env().close()
+
 
 @pytest.mark.parametrize("model_class", MODEL_LIST)
-def test_exclude_include_saved_params(tmp_path, model_class):
+def test_exclude_include_saved_params(model_class):
     """
     Test if exclude and include parameters of save() work
 
     :param model_class: (BaseAlgorithm) A RL model
     """
-    env = DummyVecEnv([lambda: select_env(model_class)])
+    env = _make_vec_env(model_class)
 
     # create model, set verbose as 2, which is not standard
     model = model_class("MlpPolicy", env, policy_kwargs=dict(net_arch=[16]), verbose=2)
 
     # Check if exclude works
-    model.save(tmp_path / "test_save", exclude=["verbose"])
+    buffer = io.BytesIO()
+    model.save(buffer, exclude=["verbose"])
+    buffer.seek(0)
     del model
-    model = model_class.load(str(tmp_path / "test_save.zip"))
+    model = model_class.load(buffer)
     # check if verbose was not saved
     assert model.verbose != 2
 
     # set verbose as something different then standard settings
     model.verbose = 2
     # Check if include works
-    model.save(tmp_path / "test_save", exclude=["verbose"], include=["verbose"])
+    buffer = io.BytesIO()
+    model.save(buffer, exclude=["verbose"], include=["verbose"])
+    buffer.seek(0)
     del model
-    model = model_class.load(str(tmp_path / "test_save.zip"))
+    model = model_class.load(buffer)
     assert model.verbose == 2
 
-    # clear file from os
-    os.remove(tmp_path / "test_save.zip")
+    env.close()
 
 
 @pytest.mark.parametrize("model_class", [TQC, QRDQN])
@@ -258,7 +401,7 @@ def test_save_load_replay_buffer(tmp_path, model_class):
 
 @pytest.mark.parametrize("model_class", MODEL_LIST)
 @pytest.mark.parametrize("policy_str", ["MlpPolicy", "CnnPolicy"])
-def test_save_load_policy(tmp_path, model_class, policy_str):
+def test_save_load_policy(model_class, policy_str):
     """
     Test saving and loading policy only.
 
@@ -299,7 +442,7 @@ def test_save_load_policy(tmp_path, model_class, policy_str):
     model.learn(total_timesteps=300)
 
     env.reset()
-    observations = np.concatenate([env.step([env.action_space.sample()])[0] for _ in range(10)], axis=0)
+    observations = _collect_observations(env)
 
     policy = model.policy
     policy_class = policy.__class__
@@ -309,10 +452,11 @@ def test_save_load_policy(tmp_path, model_class, policy_str):
         actor_class = actor.__class__
 
     # Get dictionary of current parameters
-    params = deepcopy(policy.state_dict())
+    params = _clone_state_dict(policy.state_dict())
 
     # Modify all parameters to be random values
-    random_params = {param_name: th.rand_like(param) for param_name, param in params.items()}
+    generators: Dict[th.device, th.Generator] = {}
+    random_params = {param_name: _rand_like(param, generators) for param_name, param in params.items()}
 
     # Update model parameters with the new random values
     policy.load_state_dict(random_params)
@@ -331,25 +475,28 @@ def test_save_load_policy(tmp_path, model_class, policy_str):
         selected_actions_actor, _ = actor.predict(observations, deterministic=True)
 
     # Save and load policy
-    policy.save(tmp_path / "policy.pkl")
+    policy_buffer = io.BytesIO()
+    policy.save(policy_buffer)
+    policy_buffer.seek(0)
     # Save and load actor
     if actor is not None:
-        actor.save(tmp_path / "actor.pkl")
+        actor_buffer = io.BytesIO()
+        actor.save(actor_buffer)
+        actor_buffer.seek(0)
 
     device = policy.device
 
     del policy, actor
 
-    policy = policy_class.load(tmp_path / "policy.pkl").to(device)
+    policy = policy_class.load(policy_buffer).to(device)
     if actor_class is not None:
-        actor = actor_class.load(tmp_path / "actor.pkl")
+        actor = actor_class.load(actor_buffer)
 
     # check if params are still the same after load
     new_params = policy.state_dict()
 
     # Check that all params are the same as before save load procedure now
-    for key in params:
-        assert th.allclose(params[key], new_params[key]), "Policy parameters not the same after save and load."
+    _assert_state_dicts_close(params, new_params, "Policy parameters not the same after save and load.")
 
     # check if model still selects the same actions
     new_selected_actions, _ = policy.predict(observations, deterministic=True)
@@ -360,15 +507,10 @@ def test_save_load_policy(tmp_path, model_class, policy_str):
         assert np.allclose(selected_actions_actor, new_selected_actions_actor, 1e-4)
         assert np.allclose(selected_actions_actor, new_selected_actions, 1e-4)
 
-    # clear file from os
-    os.remove(tmp_path / "policy.pkl")
-    if actor_class is not None:
-        os.remove(tmp_path / "actor.pkl")
-
 
 @pytest.mark.parametrize("model_class", [QRDQN])
 @pytest.mark.parametrize("policy_str", ["MlpPolicy", "CnnPolicy"])
-def test_save_load_q_net(tmp_path, model_class, policy_str):
+def test_save_load_q_net(model_class, policy_str):
     """
     Test saving and loading q-network/quantile net only.
 
@@ -400,7 +542,7 @@ def test_save_load_q_net(tmp_path, model_class, policy_str):
     model.learn(total_timesteps=300)
 
     env.reset()
-    observations = np.concatenate([env.step([env.action_space.sample()])[0] for _ in range(10)], axis=0)
+    observations = _collect_observations(env)
 
     q_net = model.quantile_net
     q_net_class = q_net.__class__
@@ -425,26 +567,24 @@ def test_save_load_q_net(tmp_path, model_class, policy_str):
     selected_actions, _ = q_net.predict(observations, deterministic=True)
 
     # Save and load q_net
-    q_net.save(tmp_path / "q_net.pkl")
+    buffer = io.BytesIO()
+    q_net.save(buffer)
+    buffer.seek(0)
 
     del q_net
 
-    q_net = q_net_class.load(tmp_path / "q_net.pkl")
+    q_net = q_net_class.load(buffer)
 
     # check if params are still the same after load
     new_params = q_net.state_dict()
 
     # Check that all params are the same as before save load procedure now
-    for key in params:
-        assert th.allclose(params[key], new_params[key]), "Policy parameters not the same after save and load."
+    _assert_state_dicts_close(params, new_params, "Policy parameters not the same after save and load.")
 
     # check if model still selects the same actions
     new_selected_actions, _ = q_net.predict(observations, deterministic=True)
     assert np.allclose(selected_actions, new_selected_actions, 1e-4)
 
-    # clear file from os
-    os.remove(tmp_path / "q_net.pkl")
-
 
 def test_save_load_pytorch_var(tmp_path):
     model = TQC("MlpPolicy", "Pendulum-v1", seed=3, policy_kwargs=dict(net_arch=[64], n_critics=1))
@@ -28,7 +28,7 @@ class CustomGoalEnv(gym.Env):
 
 
 def check_time_feature(obs, timestep, max_timesteps):
-    assert np.allclose(obs[-1], 1.0 - timestep / max_timesteps)
+    assert abs(obs[-1] - (1.0 - timestep / max_timesteps)) < 1e-6
 
 
 def test_time_feature():
@@ -41,10 +41,13 @@ def test_time_feature():
     for _ in range(4):
         done = False
         check_time_feature(obs, timestep=0, max_timesteps=max_timesteps)
-        for step in range(1, max_timesteps + 1):
+        # Collect the time feature and check all the steps at once
+        time_features = np.zeros(max_timesteps, dtype=np.float32)
+        for step in range(max_timesteps):
             obs, _, terminated, truncated, _ = env.step(env.action_space.sample())
-            check_time_feature(obs, timestep=step, max_timesteps=max_timesteps)
+            time_features[step] = obs[-1]
             done = terminated or truncated
+        assert np.allclose(time_features, 1.0 - np.arange(1, max_timesteps + 1) / max_timesteps)
         if done:
             obs, _ = env.reset()
 